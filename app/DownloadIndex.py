@@ -0,0 +1,215 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from app import LOGGER
+
+INDEX_FILENAME = ".download_index.json"
+
+
+def normalize_url(url: str) -> str:
+    """Normalize an enclosure url so equivalent links map to the same key.
+
+    Scheme and host are lowercased, default ports and fragments are dropped and
+    query parameters are sorted. The query itself is kept, since it can be the
+    only thing that distinguishes two files.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    if (scheme, port) in (("http", 80), ("https", 443)):
+        netloc = netloc.rsplit(":", 1)[0]
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+def content_key(data: bytes) -> str:
+    """Key downloaded content by its byte length and sha256 hash."""
+    return f"{len(data)}:{hashlib.sha256(data).hexdigest()}"
+
+
+def _size_of(key: str) -> Optional[int]:
+    try:
+        return int(key.split(":", 1)[0])
+    except ValueError:
+        return None
+
+
+def _is_name_map(value) -> bool:
+    # Stored values must be plain file names inside the download directory
+    return isinstance(value, dict) and all(
+        isinstance(k, str)
+        and isinstance(v, str)
+        and v not in ("", ".", "..")
+        and Path(v).name == v
+        for k, v in value.items()
+    )
+
+
+class DownloadIndex:
+    """Index of downloaded episodes in a directory.
+
+    Files are looked up by normalized enclosure url and by content key (real
+    byte length and sha256 hash). A url hit is hard linked without any network
+    request.
+
+    An episode under a new url is probed before it is fetched: when an indexed
+    file has the feed's enclosure length and the same first and last bytes, it
+    is hard linked instead. This is a heuristic, not a content hash check, and
+    episodes of one show that share intro and outro jingles could still match.
+    Duplicates that slip past the probe are still stored once, so the content
+    key saves disk space but not bandwidth for them.
+    """
+
+    def __init__(self, download_dir: Path):
+        self.download_dir = download_dir
+        self.path = download_dir / INDEX_FILENAME
+        self.urls: dict[str, str] = {}
+        self.contents: dict[str, str] = {}
+        self.sizes: dict[int, set[str]] = {}
+        self.signature: Optional[tuple[int, int]] = None
+        self.load()
+
+    def _signature(self) -> Optional[tuple[int, int]]:
+        # Modification time and size of the index file, to notice outside writes
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _read(self) -> Optional[dict]:
+        if not self.path.exists():
+            return None
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            LOGGER.warning(f"Ignoring unreadable download index '{self.path}': {e}")
+            return None
+
+        if not (
+            isinstance(data, dict)
+            and _is_name_map(data.get("urls", {}))
+            and _is_name_map(data.get("contents", {}))
+        ):
+            LOGGER.warning(f"Ignoring malformed download index '{self.path}'.")
+            return None
+        return data
+
+    def _merge(self, data: Optional[dict]):
+        # Entries already in memory win over the ones on disk
+        if data is None:
+            return
+        for url, name in data.get("urls", {}).items():
+            self.urls.setdefault(url, name)
+        for key, name in data.get("contents", {}).items():
+            self.contents.setdefault(key, name)
+            self._add_size(key, name)
+
+    def load(self):
+        self.signature = self._signature()
+        self._merge(self._read())
+
+    def is_stale(self) -> bool:
+        """Whether the index file was changed on disk since it was loaded or saved."""
+        return self._signature() != self.signature
+
+    def save(self):
+        # Pick up entries written by another process before overwriting them
+        if self.is_stale():
+            self._merge(self._read())
+
+        # Use atomic write by writing to temp file first
+        temp_path = self.path.with_suffix(".tmp")
+        try:
+            with temp_path.open("w", encoding="utf-8") as f:
+                json.dump({"urls": self.urls, "contents": self.contents}, f)
+            temp_path.replace(self.path)
+            self.signature = self._signature()
+        except OSError as e:
+            LOGGER.error(f"Failed to write download index '{self.path}': {e}")
+            try:
+                if temp_path.exists():
+                    temp_path.unlink()
+            except OSError:
+                pass
+
+    def _add_size(self, key: str, name: str):
+        size = _size_of(key)
+        if size is not None:
+            self.sizes.setdefault(size, set()).add(name)
+
+    def _existing(self, name: Optional[str]) -> Optional[Path]:
+        if name is None:
+            return None
+        path = self.download_dir / name
+        return path if path.is_file() else None
+
+    def find_url(self, url: str) -> Optional[Path]:
+        """Return the file previously downloaded from url, if it still exists."""
+        return self._existing(self.urls.get(normalize_url(url)))
+
+    def find_content(self, key: str) -> Optional[Path]:
+        """Return a file with the given content key, if it still exists."""
+        return self._existing(self.contents.get(key))
+
+    def has_size(self, size: int) -> bool:
+        return size in self.sizes
+
+    def find_matching(self, size: int, head: bytes, tail: bytes) -> Optional[Path]:
+        """Return an indexed file of size bytes that starts with head and ends with tail."""
+        if not head or not tail:
+            return None
+        for name in sorted(self.sizes.get(size, ())):
+            path = self._existing(name)
+            if path is None or path.stat().st_size != size:
+                continue
+            try:
+                with path.open("rb") as f:
+                    if f.read(len(head)) != head:
+                        continue
+                    f.seek(size - len(tail))
+                    if f.read(len(tail)) == tail:
+                        return path
+            except OSError:
+                continue
+        return None
+
+    def add(self, url: str, key: str, file: Path):
+        self.urls[normalize_url(url)] = file.name
+        if self.find_content(key) is None:
+            self.contents[key] = file.name
+        self._add_size(key, file.name)
+        self.save()
+
+    def add_url(self, url: str, file: Path):
+        self.urls[normalize_url(url)] = file.name
+        self.save()
+
+
+_INDEXES: dict[Path, DownloadIndex] = {}
+
+
+def get_index(download_dir: Path) -> DownloadIndex:
+    """Return the index for download_dir, reloading it only when the file changed."""
+    key = download_dir.resolve()
+    if key not in _INDEXES or _INDEXES[key].is_stale():
+        _INDEXES[key] = DownloadIndex(download_dir)
+    return _INDEXES[key]
+
+
+def link_file(source: Path, target: Path):
+    """Hard link target to source, copying when the filesystem has no hard links."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
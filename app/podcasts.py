@@ -11,6 +11,7 @@ import xml.etree.ElementTree as ET
 import pytz
 
 from app import LOGGER, CacheManager
+from app.DownloadIndex import DownloadIndex, content_key, get_index, link_file
 
 dateformats = [
     "%a, %d %b %Y %H:%M:%S %z",
@@ -18,6 +19,14 @@ dateformats = [
 ]
 
 
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Mobile Safari/537.36"
+}
+
+# Bytes fetched from each end of an enclosure to compare it with indexed files
+PROBE_BYTES = 64 * 1024
+
+
 COLORS = [
     "\033[95m",
     "\033[94m",
@@ -36,13 +45,10 @@ class Episode:
     channel: str
     description: str = ""
     author: str = ""
+    length: int = 0
     color: str = field(default="")
 
     def __post_init__(self):
-        question_mark_idx = self.link.find("?")
-        if question_mark_idx > -1:
-            self.link = self.link[0:question_mark_idx]
-
         try:
             self.date = parser.parse(self.date)
         except ValueError:
@@ -61,6 +67,45 @@ class Episode:
         name = f"{datetime.datetime.strftime(self.date, '%Y-%m-%d')}-{self.channel}-{self.title}"
         return re.sub(r"[!@#$%^&*?|:\\/]", "", name)
 
+    def fetch_range(self, start: int, end: int) -> bytes | None:
+        """Fetch bytes start..end (inclusive) of the enclosure, or None if the
+        server does not return exactly that range of a file of self.length bytes.
+        """
+        r = requests.get(
+            self.link, headers={**HEADERS, "Range": f"bytes={start}-{end}"}
+        )
+        if r.status_code != 206:
+            return None
+        # Content-Range: bytes <start>-<end>/<total>
+        match = re.fullmatch(
+            r"bytes (\d+)-(\d+)/(\d+)", r.headers.get("Content-Range", "").strip()
+        )
+        if match is None:
+            return None
+        if tuple(int(x) for x in match.groups()) != (start, end, self.length):
+            return None
+        if len(r.content) != end - start + 1:
+            return None
+        return r.content
+
+    def find_remote_duplicate(self, index: DownloadIndex) -> Path | None:
+        """Compare the ends of the enclosure with indexed files of the same size.
+
+        Only runs when the feed's enclosure length matches an indexed file, so a
+        missing or wrong length just falls back to a full download. A match is a
+        heuristic, see DownloadIndex.
+        """
+        if self.length <= 0 or not index.has_size(self.length):
+            return None
+        probe = min(PROBE_BYTES, self.length)
+        head = self.fetch_range(0, probe - 1)
+        if head is None:
+            return None
+        tail = self.fetch_range(self.length - probe, self.length - 1)
+        if tail is None:
+            return None
+        return index.find_matching(self.length, head, tail)
+
     def download(self, to: Path) -> Path:
         to.mkdir(exist_ok=True, parents=True)
         safe_title = self.safe_file_out_name
@@ -68,15 +113,35 @@ class Episode:
         if file_out.exists():
             return file_out
 
-        r = requests.get(
-            self.link,
-            headers={
-                "User-Agent": "Mozilla/5.0 (Linux; Android 6.0; Nexus 5 Build/MRA58N) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/141.0.0.0 Mobile Safari/537.36"
-            },
-        )
+        index = get_index(to)
+        existing = index.find_url(self.link)
+        if existing:
+            LOGGER.info(f"Already downloaded as '{existing}', linking.")
+            link_file(existing, file_out)
+            index.add_url(self.link, file_out)
+            return file_out
+
+        existing = self.find_remote_duplicate(index)
+        if existing:
+            LOGGER.info(
+                f"Size and first/last {PROBE_BYTES} bytes match '{existing}', "
+                "linking as a probable duplicate."
+            )
+            link_file(existing, file_out)
+            index.add_url(self.link, file_out)
+            return file_out
+
+        r = requests.get(self.link, headers=HEADERS)
         if r.status_code == 200:
-            with file_out.open("wb") as f:
-                f.write(r.content)
+            key = content_key(r.content)
+            existing = index.find_content(key)
+            if existing:
+                LOGGER.info(f"Same content as '{existing}', linking.")
+                link_file(existing, file_out)
+            else:
+                with file_out.open("wb") as f:
+                    f.write(r.content)
+            index.add(self.link, key, file_out)
             return file_out
 
         raise Exception(
@@ -222,10 +287,20 @@ class PodcastReader:
         for item in items:
             title = item.find("title").text
             date = item.find("pubDate").text
-            url = item.find("enclosure").attrib["url"]
+            enclosure = item.find("enclosure")
+            url = enclosure.attrib["url"]
+            length = enclosure.attrib.get("length", "")
             description = self.get_field(item, "description")
             author = self.get_field(item, "author")
-            episode = Episode(title, date, url, channel, description, author)
+            episode = Episode(
+                title,
+                date,
+                url,
+                channel,
+                description,
+                author,
+                int(length) if length.isdigit() else 0,
+            )
             if episode.date < cutoff:
                 break
             episodes.append(episode)
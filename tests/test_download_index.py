@@ -0,0 +1,164 @@
+import json
+import os
+from unittest import mock
+
+import pytest
+
+from app.DownloadIndex import (
+    INDEX_FILENAME,
+    DownloadIndex,
+    content_key,
+    get_index,
+    normalize_url,
+)
+from app.podcasts import Episode
+
+DATE = "Mon, 01 Jan 2024 10:00:00 +0000"
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        ("HTTPS://Example.com:443/a.mp3", "https://example.com/a.mp3"),
+        ("http://example.com:80/a.mp3#t=10", "http://example.com/a.mp3"),
+        ("http://example.com:8080/a.mp3", "http://example.com:8080/a.mp3"),
+        ("https://example.com/a.mp3?b=2&a=1", "https://example.com/a.mp3?a=1&b=2"),
+        ("https://[::1]:443/a.mp3", "https://[::1]/a.mp3"),
+        ("https://example.com", "https://example.com/"),
+    ],
+)
+def test_normalize_url(url, expected):
+    assert normalize_url(url) == expected
+
+
+def test_normalize_url_keeps_distinct_queries():
+    assert normalize_url("https://x.com/f?id=1") != normalize_url("https://x.com/f?id=2")
+
+
+@pytest.mark.parametrize(
+    "contents",
+    [
+        "not json",
+        "[]",
+        '{"urls": null}',
+        '{"urls": {"https://x.com/": 1}}',
+        '{"urls": {"https://x.com/": "/abs/path"}}',
+        '{"contents": {"1:abc": "../x"}}',
+        '{"urls": {"https://x.com/a.mp3": ".."}}',
+        '{"urls": {"https://x.com/a.mp3": "."}}',
+    ],
+)
+def test_load_ignores_bad_index(tmp_path, contents):
+    (tmp_path / INDEX_FILENAME).write_text(contents)
+    index = DownloadIndex(tmp_path)
+    assert index.urls == {}
+    assert index.contents == {}
+    assert index.find_url("https://x.com/") is None
+
+
+def test_add_and_find(tmp_path):
+    file = tmp_path / "a.mp3"
+    file.write_bytes(b"audio")
+    key = content_key(b"audio")
+
+    index = DownloadIndex(tmp_path)
+    index.add("https://X.com/a.mp3", key, file)
+
+    reloaded = DownloadIndex(tmp_path)
+    assert reloaded.find_url("https://x.com/a.mp3") == file
+    assert reloaded.find_content(key) == file
+    assert reloaded.find_matching(5, b"au", b"io") == file
+    assert reloaded.find_matching(5, b"xx", b"io") is None
+    assert not (tmp_path / ".download_index.tmp").exists()
+
+    file.unlink()
+    assert reloaded.find_url("https://x.com/a.mp3") is None
+
+
+def test_find_url_skips_directories(tmp_path):
+    (tmp_path / "sub").mkdir()
+    (tmp_path / INDEX_FILENAME).write_text('{"urls": {"https://x.com/": "sub"}}')
+    assert DownloadIndex(tmp_path).find_url("https://x.com/") is None
+
+
+def test_save_keeps_entries_from_other_writers(tmp_path):
+    for name in ("a.mp3", "b.mp3"):
+        (tmp_path / name).write_bytes(name.encode())
+
+    first = DownloadIndex(tmp_path)
+    second = DownloadIndex(tmp_path)
+    first.add("https://x.com/a.mp3", content_key(b"a.mp3"), tmp_path / "a.mp3")
+    second.add("https://x.com/b.mp3", content_key(b"b.mp3"), tmp_path / "b.mp3")
+
+    reloaded = DownloadIndex(tmp_path)
+    assert reloaded.find_url("https://x.com/a.mp3") == tmp_path / "a.mp3"
+    assert reloaded.find_url("https://x.com/b.mp3") == tmp_path / "b.mp3"
+
+
+def test_get_index_reloads_changed_file(tmp_path):
+    (tmp_path / "a.mp3").write_bytes(b"a")
+    index = get_index(tmp_path)
+    assert get_index(tmp_path) is index
+
+    DownloadIndex(tmp_path).add_url("https://x.com/a.mp3", tmp_path / "a.mp3")
+    reloaded = get_index(tmp_path)
+    assert reloaded is not index
+    assert reloaded.find_url("https://x.com/a.mp3") == tmp_path / "a.mp3"
+
+
+def response(status_code, content=b"", headers=None):
+    return mock.Mock(status_code=status_code, content=content, headers=headers or {})
+
+
+def test_download_links_url_and_content_duplicates(tmp_path):
+    with mock.patch(
+        "app.podcasts.requests.get", return_value=response(200, b"audio")
+    ) as get:
+        a = Episode("A", DATE, "https://x.com/a.mp3?id=1", "C").download(tmp_path)
+        b = Episode("B", DATE, "https://X.com/a.mp3?id=1", "D").download(tmp_path)
+        c = Episode("C", DATE, "https://y.com/c.mp3", "E").download(tmp_path)
+
+    assert get.call_count == 2
+    assert os.stat(a).st_ino == os.stat(b).st_ino == os.stat(c).st_ino
+    index = json.loads((tmp_path / INDEX_FILENAME).read_text())
+    assert len(index["urls"]) == 2
+    assert len(index["contents"]) == 1
+
+
+def test_download_links_crosspost_without_fetching_body(tmp_path):
+    with mock.patch("app.podcasts.requests.get", return_value=response(200, b"audio")):
+        a = Episode("A", DATE, "https://x.com/a.mp3", "C", length=5).download(tmp_path)
+
+    ranged = response(206, b"audio", {"Content-Range": "bytes 0-4/5"})
+    with mock.patch("app.podcasts.requests.get", return_value=ranged) as get:
+        b = Episode("B", DATE, "https://y.com/b.mp3", "D", length=5).download(tmp_path)
+
+    assert get.call_count == 2
+    assert all("Range" in call.kwargs["headers"] for call in get.call_args_list)
+    assert os.stat(a).st_ino == os.stat(b).st_ino
+
+
+@pytest.mark.parametrize(
+    "body, content_range",
+    [
+        (b"", "bytes 0-4/5"),
+        (b"aud", "bytes 0-4/5"),
+        (b"audio", "bytes 0-4/6"),
+        (b"audio", ""),
+    ],
+)
+def test_download_fetches_body_when_probe_is_invalid(tmp_path, body, content_range):
+    with mock.patch("app.podcasts.requests.get", return_value=response(200, b"audio")):
+        a = Episode("A", DATE, "https://x.com/a.mp3", "C", length=5).download(tmp_path)
+
+    def get(url, headers):
+        if "Range" in headers:
+            return response(206, body, {"Content-Range": content_range})
+        return response(200, b"other")
+
+    with mock.patch("app.podcasts.requests.get", side_effect=get) as mocked:
+        b = Episode("B", DATE, "https://y.com/b.mp3", "D", length=5).download(tmp_path)
+
+    assert "Range" not in mocked.call_args.kwargs["headers"]
+    assert b.read_bytes() == b"other"
+    assert os.stat(a).st_ino != os.stat(b).st_ino